@@ -4,7 +4,7 @@
 Generate printable PDF of circular coded photogrammetry targets described by
 (expired) patent DE19733466A1.
 
-Requires Inkscape and PDFtk.
+Requires CairoSVG and pypdf.
 
 Matthew Petroff <https://mpetroff.net>, 2018
 
@@ -12,11 +12,13 @@ This script is released into the public domain using the CC0 1.0 Public
 Domain Dedication: https://creativecommons.org/publicdomain/zero/1.0/
 '''
 
-import subprocess   # Used to run external commands
+import concurrent.futures   # Used to create sheets in parallel
 import tempfile     # Used to create temporary directory
 import os.path      # Used to manipulate file paths
+import functools    # Used to memoize SVG fragments
 import math         # Used for mathematical operations
-import numpy as np  # Used for mathematical operations
+import cairosvg     # Used to render SVG to PDF
+from pypdf import PdfWriter  # Used to combine PDF files
 
 import find_codes   # Custom module for generating binary codes
 
@@ -30,86 +32,119 @@ X_MARGIN = 0.65     # X-axis page margin for targets
 Y_MARGIN = 0.9      # Y-axis page margin for targets
 BACKGROUND_X_MARGIN = 0.25  # X-axis page margin for black background
 BACKGROUND_Y_MARGIN = 0.5   # Y-axis page margin for black background
-CODES = find_codes.generate_codes(14)   # Codes for targets
+CODES = find_codes.generate_codes_cached(14)    # Codes for targets
 FILENAME = 'targets.pdf'    # Name of output PDF file
+# Unit-circle coordinates of the boundaries between the 14 ring segments
+SEGMENT_BOUNDARIES = [(math.cos(math.tau * i / 14), math.sin(math.tau * i / 14))
+                      for i in range(15)]
 
-def add_target(x_center, y_center, dot_radius, code, code_num, first_segment):
+@functools.lru_cache(maxsize=None)
+def ring_sector(start, end, dot_radius):
     '''
-    Returns SVG data for a given target.
+    Returns SVG data for ring segments start up to (but not including) end,
+    centered on the origin. The same runs of segments occur in many codes, so
+    results are memoized.
     '''
-    # Define a white circle at the center of the target
-    out = '<circle fill="#fff" cx="{}" cy="{}" r="{}"/>\n'.format(x_center, \
-        y_center, dot_radius)
-    # Define the lines forming the outer shape of the target
-    out += '<g stroke="#fff" stroke-width="{}" fill="none">\n'.format( \
-        dot_radius)
-    for i in range(14):
-        if (1 << (13-i)) & code:
-            x_start = np.cos(np.deg2rad(360 / 14 * i)) * dot_radius * 2.5
-            y_start = np.sin(np.deg2rad(360 / 14 * i)) * dot_radius * 2.5
-            x_end = np.cos(np.deg2rad(360 / 14 * (i + 1))) \
-                * dot_radius * 2.5 - x_start
-            y_end = np.sin(np.deg2rad(360 / 14 * (i + 1))) \
-                * dot_radius * 2.5 - y_start
-            x_start += x_center
-            y_start += y_center
-            # Define a line segment in the SVG path element
-            # The path element is used to define a shape as a series of lines, curves and arcs
-            # https://developer.mozilla.org/en-US/docs/Web/SVG/Tutorial/Paths
-            out += '<path fill="#fff" d="m{} {}a{} {} 0 0 1 {} {}"' \
-                ' {}/>\n'.format(x_start, y_start, dot_radius * 2.5, \
-                dot_radius * 2.5, x_end, y_end, \
-                'id="first"' if first_segment else '')
-            first_segment = False
-    out += '</g>\n'
-    out += '<text x="{}" y="{}" font-size="{}" alignment-base="bottom" ' \
-        'font-family="Source Sans Pro, sans-serif" fill="#fff">{}' \
-        '</text>'.format(x_center - dot_radius * 3, \
-        y_center + dot_radius * 3, dot_radius / 2, code_num + 1)
-    return out
+    outer_radius = dot_radius * 3
+    inner_radius = dot_radius * 2
+    x_outer_start = SEGMENT_BOUNDARIES[start][0] * outer_radius
+    y_outer_start = SEGMENT_BOUNDARIES[start][1] * outer_radius
+    x_outer_end = SEGMENT_BOUNDARIES[end][0] * outer_radius
+    y_outer_end = SEGMENT_BOUNDARIES[end][1] * outer_radius
+    x_inner_start = SEGMENT_BOUNDARIES[start][0] * inner_radius
+    y_inner_start = SEGMENT_BOUNDARIES[start][1] * inner_radius
+    x_inner_end = SEGMENT_BOUNDARIES[end][0] * inner_radius
+    y_inner_end = SEGMENT_BOUNDARIES[end][1] * inner_radius
+    large_arc = 1 if end - start > 7 else 0
+    # Define the sector as an outer arc, a line, an inner arc back, and a
+    # closing line
+    # https://developer.mozilla.org/en-US/docs/Web/SVG/Tutorial/Paths
+    return f'<path d="M{x_outer_start} {y_outer_start}' \
+        f'A{outer_radius} {outer_radius} 0 {large_arc} 1 ' \
+        f'{x_outer_end} {y_outer_end}' \
+        f'L{x_inner_end} {y_inner_end}' \
+        f'A{inner_radius} {inner_radius} 0 {large_arc} 0 ' \
+        f'{x_inner_start} {y_inner_start}Z"/>\n'
+
+def add_target(x_center, y_center, dot_radius, code, code_num):
+    '''
+    Returns SVG data for a given target. The dot at the center of the target
+    refers to the white circle defined once per sheet by create_sheet.
+    '''
+    # Draw the target at the origin and move it into place
+    out = [f'<g transform="translate({x_center} {y_center})">\n']
+    # Place the shared white circle at the center of the target
+    out.append('<use xlink:href="#dot"/>\n')
+    # Define the filled shapes forming the outer ring of the target
+    out.append('<g fill="#fff">\n')
+    # Visit each run of adjacent set bits, most significant (segment 0) first,
+    # and draw it as a single annular sector so that no seams are left
+    remaining = code
+    while remaining:
+        top = remaining.bit_length()
+        # Flipping the bits below the top leaves the highest 0 bit as the
+        # highest 1 bit, which marks the end of the run
+        end = (remaining ^ ((1 << top) - 1)).bit_length()
+        remaining &= (1 << end) - 1
+        out.append(ring_sector(14 - top, 14 - end, dot_radius))
+    out.append('</g>\n')
+    out.append(f'<text x="{-dot_radius * 3}" y="{dot_radius * 3}" '
+               f'font-size="{dot_radius / 2}" alignment-base="bottom" '
+               'font-family="Source Sans Pro, sans-serif" fill="#fff">'
+               f'{code_num + 1}</text>\n')
+    out.append('</g>\n')
+    return ''.join(out)
 
 # Generate SVG code for sheet of targets
 def create_sheet(n, pdf_filename):
     '''
-    Constructs SVG file for sheet of targets and then uses Inkscape to combine
-    adjacent target segments into a single path and to export a PDF.
+    Constructs SVG data for sheet of targets and renders it to a PDF with
+    CairoSVG.
     '''
-    svg = '<svg xmlns="http://www.w3.org/2000/svg" width="{w}{u}" ' \
-        'height="{h}{u}" version="1.1" viewBox="0 0 {w} {h}">\n'.format( \
-        w=WIDTH, h=HEIGHT, u=UNIT)
+    svg = [f'<svg xmlns="http://www.w3.org/2000/svg" '
+           'xmlns:xlink="http://www.w3.org/1999/xlink" '
+           f'width="{WIDTH}{UNIT}" height="{HEIGHT}{UNIT}" version="1.1" '
+           f'viewBox="0 0 {WIDTH} {HEIGHT}">\n']
+    # Define the white circle at the center of every target only once
+    svg.append(f'<defs><circle id="dot" fill="#fff" '
+               f'r="{DOT_DIAMETER / 2}"/></defs>\n')
     target_size = DOT_DIAMETER * 3
     x_spacing = (WIDTH - X_MARGIN * 2 - target_size) / (COLUMNS - 1)
     y_spacing = (HEIGHT - Y_MARGIN * 2 - target_size) / (ROWS - 1)
-    svg += '<rect x="{}" y="{}" width="{}" height="{}"/>'.format( \
-        BACKGROUND_X_MARGIN, BACKGROUND_Y_MARGIN, \
-        WIDTH - BACKGROUND_X_MARGIN * 2, HEIGHT - BACKGROUND_Y_MARGIN * 2)
+    svg.append(f'<rect x="{BACKGROUND_X_MARGIN}" y="{BACKGROUND_Y_MARGIN}" '
+               f'width="{WIDTH - BACKGROUND_X_MARGIN * 2}" '
+               f'height="{HEIGHT - BACKGROUND_Y_MARGIN * 2}"/>')
+    # Compute target centers once for each column and row
+    x_centers = [X_MARGIN + target_size / 2 + j * x_spacing
+                 for j in range(COLUMNS)]
+    y_centers = [Y_MARGIN + target_size / 2 + i * y_spacing
+                 for i in range(ROWS)]
     for i in range(ROWS):
         for j in range(COLUMNS):
             num = n * COLUMNS * ROWS + i * COLUMNS + j
             if num < len(CODES):
-                svg += add_target(X_MARGIN + target_size / 2 + j * x_spacing,
-                                  Y_MARGIN + target_size / 2 + i * y_spacing,
-                                  DOT_DIAMETER / 2, CODES[num], num,
-                                  i == 0 and j == 0)
-    svg += '</svg>'
-    # Write SVG file to temporary directory and use Inkscape to convert it to PDF
-    svg_filename = os.path.join(tmp_dir, 'sheet.svg')
-    with open(svg_filename, 'w') as out_file:
-        out_file.write(svg)
-    subprocess.run(['inkscape', '-g', '--without-gui' , '--select=first',
-                    '--actions', 'EditSelectSameObjectType',
-                    '--actions', 'StrokeToPath',
-                    '--actions', 'SelectionUnion',
-                    '--actions', 'FileSave',
-                    '--actions', 'FileQuit', svg_filename])
-    subprocess.run(['inkscape', '--export-filename=' + pdf_filename, svg_filename])
+                svg.append(add_target(x_centers[j], y_centers[i],
+                                      DOT_DIAMETER / 2, CODES[num], num))
+    svg.append('</svg>')
+    cairosvg.svg2pdf(bytestring=''.join(svg).encode(), write_to=pdf_filename)
+
+def main():
+    '''
+    Creates sheets of targets and combines them into a single PDF.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Create sheets of targets in temporary directory; each sheet is
+        # independent and rendering holds the GIL, so use separate processes
+        pdfs = [os.path.join(tmp_dir, str(n) + '.pdf')
+                for n in range(math.ceil(len(CODES) / ROWS / COLUMNS))]
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            # Consume results so that any exception is raised here
+            list(executor.map(create_sheet, range(len(pdfs)), pdfs))
+        # Combine sheets into a single PDF
+        writer = PdfWriter()
+        for pdf in pdfs:
+            writer.append(pdf)
+        writer.write(FILENAME)
 
-with tempfile.TemporaryDirectory() as tmp_dir:
-    # Create sheets of targets in temporary directory
-    pdfs = []
-    for n in range(math.ceil(len(CODES) / ROWS / COLUMNS)):
-        pdf_filename = os.path.join(tmp_dir, str(n) + '.pdf')
-        create_sheet(n, pdf_filename)
-        pdfs.append(pdf_filename)
-    # Combine sheets into a single PDF
-    subprocess.run(['pdftk'] + pdfs + ['cat', 'output', FILENAME])
+if __name__ == '__main__':
+    main()
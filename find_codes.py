@@ -14,65 +14,209 @@ Domain Dedication: https://creativecommons.org/publicdomain/zero/1.0/
 '''
 
 import argparse
+import functools
+import hashlib
+import json
+import os.path
 
-def bitwise_rotate_left(val, bits, total_bits):
+np = None   # NumPy, once imported by import_numpy
+
+def import_numpy():
     '''
-    Perform a bitwise rotation to the left.
+    Import NumPy on first use, returning False if it is not installed. It is
+    not imported up front, since cached or small codes don't need it.
     '''
-    return (val << bits) & (2**total_bits-1) \
-        | ((val & (2**total_bits-1)) >> total_bits-bits)
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
 
-def find_smallest_rotation(val, total_bits):
+def generate_necklaces(total_bits):
     '''
-    Check all bitwise rotations to find smallest representation.
+    Yield every binary necklace of the given length, each as its smallest
+    rotation, in increasing order. Uses Duval's algorithm: each necklace is a
+    Lyndon word, whose length divides total_bits, repeated.
     '''
-    smallest = val
-    for i in range(1, total_bits):
-        smallest = min(bitwise_rotate_left(val, i, total_bits), smallest)
-    return smallest
+    word = 0
+    length = 1
+    while True:
+        repeats = -(-total_bits // length)
+        # Repeating word yields a value whose bits are word, word, ...
+        repeated = word * ((1 << (length * repeats)) - 1) // ((1 << length) - 1)
+        if repeats * length == total_bits:
+            yield repeated
+        # Extend word periodically to total_bits, then drop trailing 1 bits
+        word = repeated >> (length * repeats - total_bits)
+        trailing_ones = (word ^ (word + 1)).bit_length() - 1
+        word >>= trailing_ones
+        length = total_bits - trailing_ones
+        if length == 0:
+            return
+        # Increment the last (now 0) bit
+        word += 1
 
 def calc_parity(val):
     '''
     Returns True if even parity, else False.
     '''
-    parity = True
-    while val:
-        parity = not parity
-        val = val & (val - 1)
-    return parity
+    return not (val.bit_count() & 1)
 
 def count_bit_transitions(val):
     '''
     Count number of bit transitions.
     '''
-    transitions = 0
-    prev_bit = 0
+    # Each run of 1 bits ends at a 1 bit whose higher neighbor is 0
+    return (val & ~(val >> 1)).bit_count()
+
+def popcount_array(vals):
+    '''
+    Count set bits of each element of an unsigned integer array.
+    '''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(vals)
+    return np.unpackbits(vals.view(np.uint8)).reshape(vals.size, -1) \
+        .sum(axis=1)
+
+def generate_codes_vectorized(bits, transitions=None):
+    '''
+    Generate codes with NumPy, checking all candidates at once. Returns the
+    same codes, in the same order, as enumerating necklaces.
+    '''
+    mask = (1 << bits) - 1
+    # Codes all start with 0 and end with 1, allowing us to check fewer numbers
+    candidates = (np.arange(2**(bits-2), dtype=np.uint64) << 1) | 1
+
+    # Keep candidates with even parity and at least one pair of opposite
+    # segments that are both 1; both are unchanged by rotation, so check
+    # them before finding the smallest rotation
+    diff = candidates & (candidates >> (bits >> 1))
+    candidates = candidates[(diff > 0)
+                            & ((popcount_array(candidates) & 1) == 0)]
+
+    # Perform cyclic shift to minimize value
+    doubled = (candidates << bits) | candidates
+    codes = candidates.copy()
+    for i in range(1, bits):
+        np.minimum(codes, (doubled >> (bits - i)) & mask, out=codes)
+
+    # Count number of transitions, if applicable
+    if transitions is not None:
+        codes = codes[popcount_array(codes & ~(codes >> 1)) == transitions]
+
+    # Sorted unique codes match the increasing order of necklaces
+    return np.unique(codes).tolist()
+
+def _popcount_compiled(val):
+    '''
+    Count set bits; compiled by Numba, which lowers the loop to POPCNT.
+    '''
+    count = 0
     while val:
-        new_bit = val & 1
-        if new_bit > prev_bit:
-            transitions += 1
-        prev_bit = new_bit
-        val >>= 1
-    return transitions
+        val &= val - 1
+        count += 1
+    return count
+
+def _generate_codes_compiled(bits, transitions):
+    '''
+    Generate codes in a single loop compiled by Numba. A candidate is only
+    kept if it is already its own smallest rotation, so codes come out sorted
+    and unique. Pass -1 for transitions to skip the transitions check.
+    '''
+    mask = (1 << bits) - 1
+    half_bits = bits >> 1
+    # Only a small fraction of candidates are codes, so don't preallocate
+    codes = []
+    for i in range(2**(bits-2)):
+        code = (i << 1) | 1
+        # Parity and opposite pairs don't depend on rotation, and are cheaper
+        # to check than whether this is the smallest rotation
+        diff = code & (code >> half_bits)
+        if diff == 0 or _popcount_compiled(code) & 1:
+            continue
+        doubled = (code << bits) | code
+        canonical = True
+        for j in range(1, bits):
+            if ((doubled >> (bits - j)) & mask) < code:
+                canonical = False
+                break
+        if not canonical:
+            continue
+        if transitions >= 0 \
+            and _popcount_compiled(code & ~(code >> 1)) != transitions:
+            continue
+        codes.append(code)
+    return codes
+
+@functools.lru_cache(maxsize=None)
+def load_compiled_generator():
+    '''
+    Compile the code generation loop with Numba, returning None if Numba is
+    not installed. Numba is only imported here, since importing it takes
+    longer than generating codes for small numbers of bits.
+    '''
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    global _popcount_compiled
+    _popcount_compiled = njit(cache=True)(_popcount_compiled)
+    return njit(cache=True)(_generate_codes_compiled)
+
+def generate_codes_compiled(bits, transitions=None):
+    '''
+    Generate codes with the loop compiled by Numba. Returns None if Numba is
+    not installed.
+    '''
+    if bits > COMPILED_MAX_BITS:
+        raise ValueError('Compiled code generation supports at most {} ' \
+            'bits!'.format(COMPILED_MAX_BITS))
+    compiled = load_compiled_generator()
+    if compiled is None:
+        return None
+    # No code has a negative number of transitions
+    if transitions is not None and transitions < 0:
+        return []
+    return compiled(bits, -1 if transitions is None else transitions)
+
+# Below this many bits, enumerating necklaces in pure Python finishes sooner
+# than Numba can be imported and run over every candidate
+COMPILED_MIN_BITS = 24
+# The compiled loop checks rotations on a doubled code, which must fit in int64
+COMPILED_MAX_BITS = 32
+# Without Numba, the NumPy scan over every candidate only beats enumerating
+# necklaces in this narrow range; above it, the scan is slower and holds
+# several arrays of 2**(bits-2) elements
+VECTORIZED_MIN_BITS = 22
+VECTORIZED_MAX_BITS = 24
 
 def generate_codes(bits, transitions=None):
     '''
     Generate codes for a given number of bits and, optionally, a given number
     of transitions. Number of bits should be even.
     '''
-    codes = []
-    # Codes all start with 0 and end with 1, allowing us to check fewer numbers
-    for i in range(2**(bits-2)):
-        # Add 1 bit to end
-        code = (i << 1) + 1
+    if COMPILED_MIN_BITS <= bits <= COMPILED_MAX_BITS:
+        codes = generate_codes_compiled(bits, transitions)
+        if codes is not None:
+            return codes
+    if VECTORIZED_MIN_BITS <= bits <= VECTORIZED_MAX_BITS and import_numpy():
+        return generate_codes_vectorized(bits, transitions)
 
-        # Perform cyclic shift to minimize value
-        code = find_smallest_rotation(code, bits)
+    codes = []
+    half_bits = bits >> 1
+    # Necklaces are already unique, sorted, and in their smallest rotation
+    for code in generate_necklaces(bits):
+        # Codes all start with 0 and end with 1, which excludes only the
+        # all-0 and all-1 necklaces
+        if code >> (bits - 1) or not code & 1:
+            continue
 
-        # Check which pairs of opposite segments are both 1
-        half_bits = bits >> 1
-        diff = (code & (2**half_bits-1)) \
-            & ((code & ((2**half_bits-1) << half_bits)) >> half_bits)
+        # Check which pairs of opposite segments are both 1; codes fit in
+        # bits, so shifting the upper half down needs no mask
+        diff = code & (code >> half_bits)
 
         # Find parity
         parity = calc_parity(code)
@@ -80,15 +224,52 @@ def generate_codes(bits, transitions=None):
         # Count number of transitions
         num_transitions = count_bit_transitions(code) if transitions else None
 
-        # Find unique codes with even parity and at least one pair of opposite
+        # Find codes with even parity and at least one pair of opposite
         # segments that are both 1 (and correct number of transitions,
         # if applicable)
-        if parity and diff > 0 and transitions == num_transitions \
-            and code not in codes:
+        if parity and diff > 0 and transitions == num_transitions:
             codes.append(code)
 
     return codes
 
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '__pycache__')
+
+@functools.lru_cache(maxsize=None)
+def load_cached_codes(bits, transitions):
+    '''
+    Read codes saved by a previous run, generating and saving them if needed.
+    Saved codes are only used if this file hasn't changed since they were
+    generated.
+    '''
+    cache_file = os.path.join(CACHE_DIR, 'codes_{}_{}.json'.format(bits, \
+        transitions))
+    with open(__file__, 'rb') as source_file:
+        source_hash = hashlib.sha256(source_file.read()).hexdigest()
+    try:
+        with open(cache_file) as in_file:
+            cached = json.load(in_file)
+        if cached['source_hash'] == source_hash:
+            return tuple(cached['codes'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    codes = tuple(generate_codes(bits, transitions))
+    # Cache is only an optimization, so ignore an unwritable directory
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'w') as out_file:
+            json.dump({'source_hash': source_hash, 'codes': codes}, out_file)
+    except OSError:
+        pass
+    return codes
+
+def generate_codes_cached(bits, transitions=None):
+    '''
+    Same as generate_codes, but memoized in memory and on disk since the codes
+    for a given number of bits and transitions never change.
+    '''
+    return list(load_cached_codes(bits, transitions))
+
 def main():
     '''
     Process arguments and generate codes.